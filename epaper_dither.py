@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Shared Spectra-6 palette handling and fast dithering for the photo frame
+# scripts.
+#
+# Pillow's quantizer does a generic palette search per pixel. With a fixed
+# 6-color palette the nearest color can be a single table lookup: a 32768
+# entry LUT indexed by 5-bit-per-channel RGB (32 KB, fits in L1 cache).
+# When numba is installed, Floyd-Steinberg error diffusion runs as a JIT
+# kernel over that LUT; otherwise we fall back to Pillow's quantizer.
+# numpy and numba are both optional — stock Pillow is enough to run.
+
+import itertools
+import struct
+
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+# Number of vertical bands dithered in parallel. Bands are independent, so
+# error is not diffused across band edges — the seam is invisible on a
+# 6-color e-paper panel. Set to 1 for strictly sequential FS.
+DITHER_BANDS = 4
+
+# Spectra 6 palette order: White, Black, Red, Yellow, Blue, Green
+PALETTE = [
+    (255,255,255), (0,0,0),
+    (255,0,0), (255,255,0),
+    (0,0,255), (0,255,0),
+]
+
+# Flat 768-byte palette table, padded to 256 entries. putpalette() takes
+# bytes directly, so this avoids building a 768-element int list anywhere.
+PAL_BYTES = (bytes(itertools.chain.from_iterable(PALETTE))
+             + bytes(3 * (256 - len(PALETTE))))
+
+def build_palette_image():
+    pal = Image.new("P", (1,1))
+    pal.putpalette(PAL_BYTES)
+    return pal
+
+if np is not None:
+    _PAL_TABLE = np.zeros((256, 3), dtype=np.uint8)
+    _PAL_TABLE[:len(PALETTE)] = PALETTE
+    _PAL_ARR = np.array(PALETTE, dtype=np.int16)
+
+    def _build_rgb15_lut():
+        """Nearest palette index for every 5-bit-per-channel RGB bin."""
+        # Expand each 5-bit level back to 8-bit: (x<<3)|(x>>2)
+        levels = np.arange(32, dtype=np.int32)
+        levels = (levels << 3) | (levels >> 2)
+        r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+        rgb = np.stack([r, g, b], axis=-1).reshape(-1, 1, 3)
+        dist = ((rgb - _PAL_ARR[None, :, :].astype(np.int32)) ** 2).sum(-1)
+        return dist.argmin(-1).astype(np.uint8)
+
+    NEAREST_LUT = _build_rgb15_lut()
+    # Panel color codes in PALETTE order. The epd7in3e controller counts
+    # black, white, yellow, red, (orange), blue, green as 0..6.
+    _PANEL_CODES = np.array([1, 0, 3, 2, 5, 6], dtype=np.uint8)
+else:
+    _PAL_ARR = None
+    NEAREST_LUT = None
+
+# Palette-carrier image for Pillow's quantizer, built on first use: the
+# numpy/numba paths only ever touch PAL_BYTES and the arrays above, so on
+# hosts with the fast path this PIL image is never allocated at all.
+_PAL_IMG = None
+
+def pal_img():
+    global _PAL_IMG
+    if _PAL_IMG is None:
+        _PAL_IMG = build_palette_image()
+    return _PAL_IMG
+
+def _fs_dither_rows(arr):
+    """Serpentine FS dither for deployments with numpy but no numba.
+
+    The in-row 7/16 propagation is inherently serial, so that stays a
+    per-column loop over plain Python ints; the three next-row
+    contributions (3/5/1 over 16) are applied as shifted vector adds once
+    per row. Same stencil and serpentine order as the numba kernel,
+    without the band split.
+    """
+    h, w = arr.shape[0], arr.shape[1]
+    out = np.empty((h, w), np.uint8)
+    lut = NEAREST_LUT
+    for y in range(h):
+        vals = arr[y].tolist()
+        err = np.zeros((w, 3), np.int16)
+        step = 1 if y % 2 == 0 else -1
+        rng = range(w) if step == 1 else range(w - 1, -1, -1)
+        for x in rng:
+            r, g, b = vals[x]
+            r = min(max(r, 0), 255)
+            g = min(max(g, 0), 255)
+            b = min(max(b, 0), 255)
+            idx = int(lut[((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)])
+            out[y, x] = idx
+            pr, pg, pb = PALETTE[idx]
+            er, eg, eb = r - pr, g - pg, b - pb
+            if 0 <= x + step < w:
+                nx = vals[x + step]
+                nx[0] += er * 7 // 16
+                nx[1] += eg * 7 // 16
+                nx[2] += eb * 7 // 16
+            err[x, 0] = er
+            err[x, 1] = eg
+            err[x, 2] = eb
+        if y + 1 < h:
+            nxt = arr[y + 1]
+            nxt += err * 5 // 16
+            if step == 1:
+                # 3/16 lands at x-1, 1/16 at x+1
+                nxt[:-1] += err[1:] * 3 // 16
+                nxt[1:] += err[:-1] // 16
+            else:
+                nxt[1:] += err[:-1] * 3 // 16
+                nxt[:-1] += err[1:] // 16
+    return out
+
+# Reusable int16 canvas per target size: the dither kernel both reads the
+# pasted pixels and scribbles its error diffusion into the same buffer, so
+# one allocation serves every frame.
+_CANVAS_CACHE = {}
+
+def quantize_canvas(resized, target_w, target_h, x, y):
+    """Center resized onto a white target_w x target_h canvas and quantize.
+
+    Fuses the paste and the dither over one preallocated buffer instead of
+    allocating a fresh white canvas, a pasted copy and a quantized image
+    per frame. Falls back to the PIL paste + quantize path when numpy is
+    unavailable.
+    """
+    if np is None:
+        canvas = Image.new("RGB", (target_w, target_h), (255,255,255))
+        canvas.paste(resized, (x, y))
+        return quantize(canvas)
+    canvas = _CANVAS_CACHE.get((target_w, target_h))
+    if canvas is None:
+        canvas = np.empty((target_h, target_w, 3), np.int16)
+        _CANVAS_CACHE[(target_w, target_h)] = canvas
+    canvas[:] = 255
+    arr = np.asarray(resized if resized.mode == "RGB" else resized.convert("RGB"))
+    canvas[y:y+arr.shape[0], x:x+arr.shape[1]] = arr
+    if _fs_dither is not None:
+        idx = _fs_dither(canvas, NEAREST_LUT, _PAL_ARR, DITHER_BANDS)
+    else:
+        idx = _fs_dither_rows(canvas)
+    out = Image.fromarray(idx, "P")
+    out.putpalette(PAL_BYTES)
+    return out
+
+def save_bmp(path, img):
+    """Write a 'P' mode image as an indexed BMP directly.
+
+    The fixed layout (14-byte file header, 40-byte info header, BGRA
+    palette, then raw rows) makes the save a header pack plus one
+    tobytes() — no generic Pillow encoder plugin dispatch. A negative
+    height gives top-down row order, so no flip either. Our 6-color
+    frames fit in 4 bits, so they pack two pixels per byte (192 KB
+    instead of 384 KB for 800x480, read natively by PIL and fbi);
+    images using indices above 15 get the plain 8-bpp layout. Falls
+    back to img.save for non-palette images or numpy-less hosts.
+    """
+    if np is None or img.mode != "P":
+        img.save(path)
+        return
+    idx = np.asarray(img, dtype=np.uint8)
+    h, w = idx.shape
+    if idx.max() < 16:
+        bpp, colors = 4, 16
+        if w % 2:
+            idx = np.pad(idx, ((0, 0), (0, 1)))
+        rows = (idx[:, 0::2] << 4) | idx[:, 1::2]
+    else:
+        bpp, colors = 8, 256
+        rows = idx
+    pad = -rows.shape[1] % 4
+    if pad:
+        rows = np.pad(rows, ((0, 0), (0, pad)))
+    src_pal = img.getpalette() or list(PAL_BYTES)
+    pal = bytearray(4 * colors)
+    for i in range(min(colors, len(src_pal) // 3)):
+        r, g, b = src_pal[3 * i:3 * i + 3]
+        pal[4 * i:4 * i + 3] = bytes((b, g, r))
+    offset = 14 + 40 + len(pal)
+    body = rows.tobytes()
+    with open(path, "wb") as f:
+        f.write(struct.pack("<2sIHHI", b"BM", offset + len(body), 0, 0,
+                            offset))
+        f.write(struct.pack("<IiiHHIIiiII", 40, w, -h, 1, bpp, 0,
+                            len(body), 2835, 2835, colors, 0))
+        f.write(pal)
+        f.write(body)
+
+def pack_panel_indices(idx):
+    """Pack an (H, W) uint8 palette-index array into the controller's
+    nibble buffer: two 4-bit color codes per byte, 192 KB for 800x480 —
+    the same layout epd.getbuffer produces, via two vector ops instead
+    of ~384k Python-level iterations.
+    """
+    codes = _PANEL_CODES[idx]
+    packed = (codes[:, 0::2] << 4) | codes[:, 1::2]
+    return packed.tobytes()
+
+def pack_panel_buffer(img):
+    """Pack a panel-sized 'P' image into the controller's nibble buffer.
+
+    Returns None when numpy is unavailable so callers can fall back to
+    epd.getbuffer.
+    """
+    if np is None:
+        return None
+    return pack_panel_indices(np.asarray(img, dtype=np.uint8))
+
+if njit is not None:
+    @njit(cache=True)
+    def _fs_dither_slice(arr, lut, pal, out, xa, xb):
+        """Serpentine Floyd-Steinberg over columns [xa, xb) of an (H,W,3)
+        int16 array, writing palette indices into out. Error diffusion
+        stays inside the band.
+
+        Pending error lives in six per-channel row buffers (current +
+        next row, ping-ponged) instead of being scattered back into the
+        interleaved source array: FS only ever touches two rows, and the
+        structure-of-arrays layout keeps each channel's line contiguous
+        in cache where the (H,W,3) writes were strided.
+        """
+        h = arr.shape[0]
+        w = xb - xa
+        cur_r = np.zeros(w, np.int32)
+        cur_g = np.zeros(w, np.int32)
+        cur_b = np.zeros(w, np.int32)
+        nxt_r = np.zeros(w, np.int32)
+        nxt_g = np.zeros(w, np.int32)
+        nxt_b = np.zeros(w, np.int32)
+        for y in range(h):
+            if y % 2 == 0:
+                i0, i1, step = 0, w, 1
+            else:
+                i0, i1, step = w - 1, -1, -1
+            for i in range(i0, i1, step):
+                x = xa + i
+                r = min(max(arr[y, x, 0] + cur_r[i], 0), 255)
+                g = min(max(arr[y, x, 1] + cur_g[i], 0), 255)
+                b = min(max(arr[y, x, 2] + cur_b[i], 0), 255)
+                if r == 255 and g == 255 and b == 255:
+                    # Pure white: letterbox margins are solid white by
+                    # construction, so skip even the LUT load here.
+                    out[y, x] = 0
+                    continue
+                idx = lut[((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)]
+                out[y, x] = idx
+                er = r - pal[idx, 0]
+                eg = g - pal[idx, 1]
+                eb = b - pal[idx, 2]
+                if er == 0 and eg == 0 and eb == 0:
+                    # Exact palette hit (posters, line art, re-shown BMPs):
+                    # nothing to diffuse, skip the neighbor stores.
+                    continue
+                if 0 <= i + step < w:
+                    cur_r[i + step] += er * 7 // 16
+                    cur_g[i + step] += eg * 7 // 16
+                    cur_b[i + step] += eb * 7 // 16
+                    nxt_r[i + step] += er // 16
+                    nxt_g[i + step] += eg // 16
+                    nxt_b[i + step] += eb // 16
+                if 0 <= i - step < w:
+                    nxt_r[i - step] += er * 3 // 16
+                    nxt_g[i - step] += eg * 3 // 16
+                    nxt_b[i - step] += eb * 3 // 16
+                nxt_r[i] += er * 5 // 16
+                nxt_g[i] += eg * 5 // 16
+                nxt_b[i] += eb * 5 // 16
+            cur_r, nxt_r = nxt_r, cur_r
+            cur_g, nxt_g = nxt_g, cur_g
+            cur_b, nxt_b = nxt_b, cur_b
+            nxt_r[:] = 0
+            nxt_g[:] = 0
+            nxt_b[:] = 0
+
+    @njit(cache=True, parallel=True)
+    def _fs_dither(arr, lut, pal, bands):
+        """Dither arr in `bands` independent vertical bands in parallel."""
+        h, w = arr.shape[0], arr.shape[1]
+        out = np.empty((h, w), np.uint8)
+        for b in prange(bands):
+            xa = w * b // bands
+            xb = w * (b + 1) // bands
+            _fs_dither_slice(arr, lut, pal, out, xa, xb)
+        return out
+
+    @njit(cache=True)
+    def _atkinson_dither_slice(arr, lut, pal, out, xa, xb):
+        """Atkinson dither over columns [xa, xb): 1/8 of the error to six
+        neighbors, the remaining 2/8 dropped. Only shifts, no fractional
+        multiplies, and the lost error keeps highlights/shadows clean —
+        a good match for a palette with no greys.
+        """
+        h = arr.shape[0]
+        for y in range(h):
+            for x in range(xa, xb):
+                r = min(max(arr[y, x, 0], 0), 255)
+                g = min(max(arr[y, x, 1], 0), 255)
+                b = min(max(arr[y, x, 2], 0), 255)
+                if r == 255 and g == 255 and b == 255:
+                    # Pure white letterbox margin — no LUT load needed.
+                    out[y, x] = 0
+                    continue
+                idx = lut[((r >> 3) << 10) | ((g >> 3) << 5) | (b >> 3)]
+                out[y, x] = idx
+                er = (r - pal[idx, 0]) >> 3
+                eg = (g - pal[idx, 1]) >> 3
+                eb = (b - pal[idx, 2]) >> 3
+                if er == 0 and eg == 0 and eb == 0:
+                    continue
+                if x + 1 < xb:
+                    arr[y, x + 1, 0] += er
+                    arr[y, x + 1, 1] += eg
+                    arr[y, x + 1, 2] += eb
+                if x + 2 < xb:
+                    arr[y, x + 2, 0] += er
+                    arr[y, x + 2, 1] += eg
+                    arr[y, x + 2, 2] += eb
+                if y + 1 < h:
+                    if x - 1 >= xa:
+                        arr[y + 1, x - 1, 0] += er
+                        arr[y + 1, x - 1, 1] += eg
+                        arr[y + 1, x - 1, 2] += eb
+                    arr[y + 1, x, 0] += er
+                    arr[y + 1, x, 1] += eg
+                    arr[y + 1, x, 2] += eb
+                    if x + 1 < xb:
+                        arr[y + 1, x + 1, 0] += er
+                        arr[y + 1, x + 1, 1] += eg
+                        arr[y + 1, x + 1, 2] += eb
+                if y + 2 < h:
+                    arr[y + 2, x, 0] += er
+                    arr[y + 2, x, 1] += eg
+                    arr[y + 2, x, 2] += eb
+
+    @njit(cache=True, parallel=True)
+    def _atkinson_dither(arr, lut, pal, bands):
+        """Atkinson-dither arr in `bands` independent vertical bands."""
+        h, w = arr.shape[0], arr.shape[1]
+        out = np.empty((h, w), np.uint8)
+        for b in prange(bands):
+            xa = w * b // bands
+            xb = w * (b + 1) // bands
+            _atkinson_dither_slice(arr, lut, pal, out, xa, xb)
+        return out
+else:
+    _fs_dither = None
+    _atkinson_dither = None
+
+def nearest6(arr):
+    """Vectorized nearest-palette indices for an (H,W,3) uint8 array.
+
+    One LUT fancy-index over the whole frame — no per-pixel argmin.
+    """
+    a = arr.astype(np.int32)
+    return NEAREST_LUT[((a[..., 0] >> 3) << 10) |
+                       ((a[..., 1] >> 3) << 5) |
+                       (a[..., 2] >> 3)]
+
+def quantize_indices(img, dither=True, method="fs"):
+    """Quantize an RGB image to an (H, W) uint8 palette-index array.
+
+    Returns None when numpy is unavailable; callers then go through
+    quantize() and Pillow. Feeding the array straight to
+    pack_panel_indices() skips the 'P' Image round trip that quantize()
+    does for callers who want a PIL image.
+    """
+    if np is None:
+        return None
+    if not dither:
+        arr = np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+        return nearest6(arr)
+    arr = np.asarray(img, dtype=np.int16)
+    if method == "atkinson" and _atkinson_dither is not None:
+        return _atkinson_dither(arr, NEAREST_LUT, _PAL_ARR, DITHER_BANDS)
+    if _fs_dither is not None:
+        return _fs_dither(arr, NEAREST_LUT, _PAL_ARR, DITHER_BANDS)
+    return _fs_dither_rows(arr)
+
+def quantize(img, dither=True, method="fs"):
+    """Quantize an RGB image to the 6-color palette.
+
+    With dither=True, error diffusion via the numba LUT kernels when
+    available (method "fs" or "atkinson"), Pillow's quantizer otherwise.
+    With dither=False (solid tints, synthetic frames), a single
+    vectorized nearest-color pass. Returns a 'P' mode image carrying the
+    Spectra-6 palette.
+    """
+    idx = quantize_indices(img, dither=dither, method=method)
+    if idx is None:
+        if not dither:
+            return img.quantize(palette=pal_img(), dither=Image.NONE,
+                                kmeans=0)
+        return img.quantize(palette=pal_img(), dither=Image.FLOYDSTEINBERG,
+                            kmeans=0)
+    out = Image.fromarray(idx, "P")
+    out.putpalette(PAL_BYTES)
+    return out
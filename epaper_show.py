@@ -12,104 +12,247 @@
 # Optional:
 #   python3 epaper_show.py /path/to/photo.jpg --rotate 0|90|180|270
 
-import sys, argparse, time
+import sys, argparse, hashlib, os, signal, threading, time
 from pathlib import Path
-from PIL import Image
+from PIL import Image, ImageOps
 
-# Import Waveshare driver
-# Make sure you run this from inside the Waveshare examples directory OR
-# that the 'lib' folder is on sys.path.
-dir_epd = str(Path(__file__).resolve().parents[1] / "lib")
-if dir_epd not in sys.path:
-    sys.path.append(dir_epd)
+# In-process HEIC/HEIF decode (iPhone photos) when pillow-heif is
+# installed — no heif-convert fork or JPEG round trip through disk, and
+# Image.open just handles .heic like any other format.
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
 
-from waveshare_epd import epd7in3e
+# Import Waveshare driver. The package lives next to this script, so the
+# plain import works; only fall back to the Waveshare examples layout
+# (repo/lib/waveshare_epd) when it doesn't, and insert at the front so a
+# module miss doesn't rescan every other sys.path entry first.
+try:
+    from waveshare_epd import epd7in3e
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "lib"))
+    from waveshare_epd import epd7in3e
+
+# Palette image and LUT are built once at import in epaper_dither and
+# shared by all scripts.
+from epaper_dither import (PAL_BYTES, pack_panel_buffer, pack_panel_indices,
+                           quantize, quantize_indices)
 
 W, H = 800, 480
 
-# Spectra 6 palette order: White, Black, Red, Yellow, Blue, Green
-PALETTE = [
-    (255,255,255), (0,0,0),
-    (255,0,0), (255,255,0),
-    (0,0,255), (0,255,0),
-]
-
-def build_palette_image():
-    pal = Image.new("P", (1,1))
-    table = []
-    for (r,g,b) in PALETTE:
-        table += [r,g,b]
-    # pad to 256 entries
-    table += [0,0,0] * (256 - len(PALETTE))
-    pal.putpalette(table)
-    return pal
-
-PAL_IMG = build_palette_image()
-
-def to_epaper_canvas(src: Image.Image, rotate: int = 0) -> Image.Image:
+# transpose() uses Pillow's direct 90-degree C path (pure index permutation)
+# instead of rotate()'s generic affine-transform machinery.
+ROTATIONS = {90: Image.ROTATE_90, 180: Image.ROTATE_180, 270: Image.ROTATE_270}
+
+def fit_to_panel(src: Image.Image, rotate: int = 0) -> Image.Image:
+    """Return an 800x480 RGB image filling the screen (not yet quantized)."""
+    src.load()
+    img = src if src.mode == "RGB" else src.convert("RGB")
+    if rotate in ROTATIONS:
+        img = img.transpose(ROTATIONS[rotate])
+
+    # Cheap bilinear pre-shrink for huge inputs, then one fused
+    # resize-and-center-crop. ImageOps.fit never materializes the oversized
+    # scaled intermediate the old resize-then-crop pair allocated; 3x the
+    # target leaves the final filter plenty of data.
+    f = 3 * max(W / img.width, H / img.height)
+    if f < 0.5:
+        img = img.resize((round(img.width * f), round(img.height * f)),
+                         Image.BILINEAR)
+    return ImageOps.fit(img, (W, H), Image.BICUBIC, centering=(0.5, 0.5))
+
+def to_epaper_canvas(src: Image.Image, rotate: int = 0,
+                     dither: str = "fs") -> Image.Image:
     """Return an 800x480 Image in our 6-color palette, filling the screen."""
-    img = src.convert("RGB")
-    if rotate in (90,180,270):
-        img = img.rotate(rotate, expand=True)
-
-    iw, ih = img.size
-    target_ratio = W / H
-    image_ratio = iw / ih
-
-    if image_ratio > target_ratio:
-        # Image is wider than display ratio - scale to height
-        scale = H / ih
-        nw, nh = int(iw * scale), H
-        # Center horizontally
-        x = (nw - W) // 2
-        y = 0
-        # Crop to width
-        img = img.resize((nw, nh), Image.LANCZOS)
-        img = img.crop((x, y, x + W, y + H))
+    # Dither into fixed 6-color palette (LUT + numba kernel when available,
+    # Pillow's quantizer otherwise)
+    return quantize(fit_to_panel(src, rotate),
+                    dither=(dither != "none"), method=dither)
+
+def is_prepared_panel_image(img: Image.Image) -> bool:
+    """True when img is already panel-sized and carries our 6-color palette.
+
+    Prepared BMP/PNG files (e.g. epaper_convert_and_show output) can be
+    packed for the panel directly — re-running resize + dithering on them
+    would only waste time and re-diffuse existing dither patterns.
+    """
+    if img.mode != "P" or img.size != (W, H):
+        return False
+    pal = img.getpalette()
+    return pal is not None and pal[:18] == list(PAL_BYTES[:18])
+
+# Packed panel buffers cached by (source content hash, rotation): hashing
+# the bytes means edits, renames and copies all resolve correctly, and the
+# cache lives out of the way instead of as sidecars next to the photos.
+CACHE_DIR = Path.home() / ".cache" / "epaper"
+
+# Keep at most this many packed buffers around (~192 KB each, so ~48 MB).
+CACHE_LIMIT = 256
+
+def prune_cache(limit=CACHE_LIMIT):
+    """Drop the oldest cached buffers once the cache exceeds limit.
+
+    One os.scandir pass over the directory; on Linux each e.stat() is
+    still a real stat call (only the is_file() check comes free from the
+    dirent type), but it's one directory walk total rather than a glob
+    per delete.
+    """
+    try:
+        entries = [(e.stat().st_mtime, e.path)
+                   for e in os.scandir(CACHE_DIR) if e.is_file()]
+    except OSError:
+        return
+    entries.sort()
+    for _, path in entries[:len(entries) - limit]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def panelbuf_cache_path(src_path: Path, rotate: int, dither: str) -> Path:
+    digest = hashlib.sha1(src_path.read_bytes()).hexdigest()
+    return CACHE_DIR / f"{digest}_r{rotate}_{dither}.bin"
+
+def prepare_buffer(src_path: Path, rotate: int, dither: str, epd) -> bytes:
+    """Return the packed panel buffer for src_path, via the cache if hot."""
+    cache_path = panelbuf_cache_path(src_path, rotate, dither)
+    # One open attempt instead of exists()+read: saves a stat and can't
+    # race against the cache pruner unlinking between the two calls.
+    try:
+        buf = cache_path.read_bytes()
+        if len(buf) == W * H // 2:
+            return buf
+        # Wrong size means a write was cut short (power loss mid-write
+        # on an SD card); fall through and regenerate the entry.
+    except FileNotFoundError:
+        pass
+    src = Image.open(src_path)
+    if src.format == "JPEG":
+        # Let libjpeg decode at a DCT-scaled size >= 2x the panel;
+        # the resize then starts from ~1000x600 instead of 12 MP.
+        src.draft("RGB", (W * 2, H * 2))
+    src.load()
+    if rotate == 0 and is_prepared_panel_image(src):
+        buf = pack_panel_buffer(src)
+        if buf is None:
+            buf = bytes(epd.getbuffer(src))
     else:
-        # Image is taller than display ratio - scale to width
-        scale = W / iw
-        nw, nh = W, int(ih * scale)
-        # Center vertically
-        x = 0
-        y = (nh - H) // 2
-        # Crop to height
-        img = img.resize((nw, nh), Image.LANCZOS)
-        img = img.crop((x, y, x + W, y + H))
-
-    # Dither into fixed 6-color palette
-    q = img.quantize(palette=PAL_IMG, dither=Image.FLOYDSTEINBERG)
-    return q
+        # Pack the kernel's index array directly — no intermediate 'P'
+        # Image (fromarray copy + putpalette) just to read it back out.
+        rgb = fit_to_panel(src, rotate)
+        idx = quantize_indices(rgb, dither=(dither != "none"), method=dither)
+        if idx is not None:
+            buf = pack_panel_indices(idx)
+        else:
+            buf = bytes(epd.getbuffer(quantize(rgb, dither=(dither != "none"),
+                                               method=dither)))
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Write-then-rename so an interrupted write never leaves a truncated
+    # .bin under the final name — the rename is atomic, the cache entry
+    # either exists complete or not at all.
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(buf)
+    os.replace(tmp_path, cache_path)
+    prune_cache()
+    return buf
+
+def prewarm(buf):
+    """Touch one byte per cache line so the 192 KB panel buffer is hot.
+
+    display() streams the buffer over SPI in a tight loop; pulling it
+    back into cache up front beats taking the misses interleaved with
+    the SPI FIFO fills.
+    """
+    for i in range(0, len(buf), 64):
+        buf[i]
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("image", help="Path to source image (jpg/png/etc.)")
+    ap.add_argument("image", nargs="?",
+                    help="Path to source image (jpg/png/etc.); "
+                         "omit with --stdin-loop")
     ap.add_argument("--rotate", type=int, choices=[0,90,180,270], default=0,
                     help="Rotate before placing onto canvas")
+    ap.add_argument("--dither", choices=["fs", "atkinson", "none"],
+                    default="fs",
+                    help="Error diffusion: Floyd-Steinberg (default), "
+                         "Atkinson (cleaner highlights, cheaper), or none")
+    ap.add_argument("--stdin-loop", action="store_true",
+                    help="Init the panel once, then display image paths "
+                         "read line-by-line from stdin; sleep on EOF")
     args = ap.parse_args()
 
-    src_path = Path(args.image)
-    if not src_path.exists():
-        print(f"File not found: {src_path}")
-        sys.exit(1)
+    if not args.stdin_loop:
+        if args.image is None:
+            ap.error("image path required unless --stdin-loop is given")
+        src_path = Path(args.image)
+        if not src_path.exists():
+            print(f"File not found: {src_path}")
+            sys.exit(1)
 
     try:
         epd = epd7in3e.EPD()
-        epd.init()
 
-        # Prepare and display image
-        src = Image.open(src_path)
-        img = to_epaper_canvas(src, rotate=args.rotate)
-        epd.display(epd.getbuffer(img))
+        if args.stdin_loop:
+            # Batch mode for frame servers / slideshows: pay EPD() +
+            # init() (SPI open, GPIO setup, panel power-on) once instead
+            # of once per image. SIGTERM lands on the same cleanup path
+            # as Ctrl-C so the panel still gets its deep-sleep command.
+            def _term(signum, frame):
+                raise KeyboardInterrupt
+            signal.signal(signal.SIGTERM, _term)
+            epd.init()
+            for line in sys.stdin:
+                path = Path(line.strip())
+                if not line.strip():
+                    continue
+                if not path.exists():
+                    print(f"File not found: {path}")
+                    continue
+                buf = prepare_buffer(path, args.rotate, args.dither, epd)
+                prewarm(buf)
+                epd.display(buf)
+            epd.sleep()
+            return
 
-        # Give it time to complete the refresh
-        time.sleep(2)
+        # Reuse the packed panel buffer if we prepared this photo before;
+        # quantizing + packing takes seconds on a Pi, the read is instant.
+        # Panel init spends most of its ~1-2 s waiting on the BUSY pin
+        # (a syscall that releases the GIL), so the CPU-only buffer prep
+        # can run concurrently on a worker thread.
+        buf_holder = {}
 
-        # Put panel to sleep (image remains)
+        def _prepare_worker():
+            # Catch failures (corrupt/unreadable image) so the main
+            # thread can re-raise them after join() — otherwise the
+            # thread dumps a raw traceback and the real error is lost
+            # behind a KeyError on "buf".
+            try:
+                buf_holder["buf"] = prepare_buffer(src_path, args.rotate,
+                                                   args.dither, epd)
+            except Exception as e:
+                buf_holder["err"] = e
+
+        worker = threading.Thread(target=_prepare_worker)
+        worker.start()
+        epd.init()
+        worker.join()
+        if "err" in buf_holder:
+            raise buf_holder["err"]
+        buf = buf_holder["buf"]
+        prewarm(buf)
+        epd.display(buf)
+
+        # display() already blocks on the BUSY pin until the refresh
+        # finishes (TurnOnDisplay polls it), so no fixed 2 s sleep here —
+        # just a brief settle before the deep-sleep command.
+        time.sleep(0.1)
+
+        # Put panel to sleep (image remains). sleep() already powers the
+        # module down via module_exit(), so no second call here.
         epd.sleep()
-        
-        # Power down the panel completely
-        epd7in3e.epdconfig.module_exit()
 
     except KeyboardInterrupt:
         epd7in3e.epdconfig.module_exit()
@@ -2,10 +2,25 @@
 import logging
 from waveshare_epd import epd7in3e
 import time
-from PIL import Image, ImageDraw, ImageFont
+
+from epaper_dither import PALETTE
 
 logging.basicConfig(level=logging.DEBUG)
 
+W, H = epd7in3e.EPD_WIDTH, epd7in3e.EPD_HEIGHT
+
+# Panel color codes in PALETTE order (the controller counts black, white,
+# yellow, red, (orange), blue, green as 0..6).
+PANEL_CODES = [1, 0, 3, 2, 5, 6]
+
+# A solid frame is just one 4-bit color code repeated across the panel —
+# no PIL image, no quantize pass, no per-pixel getbuffer walk. Build all
+# six packed buffers once at import.
+SOLID_BUFFERS = {
+    rgb: bytes([(code << 4) | code]) * (W * H // 2)
+    for rgb, code in zip(PALETTE, PANEL_CODES)
+}
+
 try:
     logging.info("epaper test start")
 
@@ -16,11 +31,8 @@ try:
     logging.info("Clear...")
     epd.Clear()
 
-    # Create new image with red color
-    logging.info("Drawing red image...")
-    image = Image.new('RGB', (epd.width, epd.height), 'red')
-    epd.display(epd.getbuffer(image))
-    logging.info("Showing red image...")
+    logging.info("Showing red frame...")
+    epd.display(SOLID_BUFFERS[(255, 0, 0)])
 
     time.sleep(2)
 
@@ -36,4 +48,4 @@ except IOError as e:
 except KeyboardInterrupt:
     logging.info("ctrl + c:")
     epd7in3e.epdconfig.module_exit()
-    exit()
\ No newline at end of file
+    exit()
@@ -24,6 +24,25 @@ def check_spi_permissions():
         print(f"SPI Error: {e}")
         return False
 
+def check_spi_bufsiz():
+    """Check the spidev kernel transfer buffer size"""
+    path = '/sys/module/spidev/parameters/bufsiz'
+    try:
+        with open(path) as f:
+            bufsiz = int(f.read().strip())
+    except (OSError, ValueError):
+        print("Could not read spidev bufsiz (module not loaded?)")
+        return False
+    print(f"spidev bufsiz: {bufsiz} bytes")
+    if bufsiz < 65536:
+        # A full 800x480 panel frame is 192 KB; with the default 4 KB
+        # buffer writebytes2() splits it into ~48 transfers, each paying
+        # an inter-chunk gap. 64 KB drops that to 3.
+        print("Tip: raise the SPI buffer so frames go out in a few big chunks:")
+        print("  sudo modprobe -r spidev && sudo modprobe spidev bufsiz=65536")
+        print("  (or add spidev.bufsiz=65536 to /boot/cmdline.txt)")
+    return True
+
 def main():
     print("=== SPI Test ===")
     print("\nChecking SPI device...")
@@ -34,6 +53,9 @@ def main():
     if not check_spi_permissions():
         return
 
+    print("\nChecking SPI buffer size...")
+    check_spi_bufsiz()
+
     print("\nSPI access test successful!")
 
 if __name__ == "__main__":